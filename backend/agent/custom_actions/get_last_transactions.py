@@ -81,6 +81,63 @@ def get_last_transactions(contract_address: str, network: str) -> List[Dict]:
         print(f"Error fetching transactions: {str(e)}")
         return []
 
+def get_transaction_hashes(contract_address: str, network: str, from_block: int, to_block: int) -> List[Dict]:
+    """
+    Get every transaction sent to or from a contract in a block range.
+    
+    Unlike contract logs this includes failed transactions and plain transfers
+    that emit no events.
+    
+    Args:
+        contract_address (str): The contract address to monitor
+        network (str): The network (ethereum, base, base-sepolia)
+        from_block (int): First block of the range
+        to_block (int): Last block of the range
+    
+    Returns:
+        List[Dict]: Hash and block number of each transaction, oldest first
+    """
+    config = get_network_config(network)
+    if not config or not config.get('api_key'):
+        raise ValueError(f"No explorer API key configured for network: {network}")
+    
+    page_size = 1000
+    transactions = []
+    page = 1
+    while True:
+        params = {
+            'module': 'account',
+            'action': 'txlist',
+            'address': contract_address,
+            'startblock': from_block,
+            'endblock': to_block,
+            'page': page,
+            'offset': page_size,
+            'sort': 'asc',
+            'apikey': config['api_key']
+        }
+        
+        response = requests.get(config['api_url'], params=params, timeout=30)
+        data = response.json()
+        
+        if data.get('status') != '1':
+            # an empty range is reported as an error status
+            if data.get('message') == 'No transactions found':
+                break
+            raise Exception(f"API Error: {data.get('message', 'Unknown error')}")
+        
+        result = data.get('result', [])
+        transactions.extend({
+            'hash': tx.get('hash'),
+            'block_number': int(tx.get('blockNumber'))
+        } for tx in result)
+        
+        if len(result) < page_size:
+            break
+        page += 1
+    
+    return transactions
+
 def format_transaction_log(tx: Dict) -> str:
     """Format a transaction for logging"""
     return (
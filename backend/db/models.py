@@ -56,6 +56,13 @@ class Log(Base):
     
     contract = relationship("Contract", back_populates="logs")
 
+class MonitorState(Base):
+    __tablename__ = 'monitor_state'
+    
+    contract_id = Column(Integer, ForeignKey('contracts.id'), primary_key=True)
+    last_processed_block = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class Wallet(Base):
     __tablename__ = 'wallet'
     
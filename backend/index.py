@@ -33,6 +33,9 @@ contract_monitor = ContractMonitor(Session)
 # setup SQLite tables
 setup()
 
+# resume monitoring stored contracts from their last processed block
+contract_monitor.resume_monitoring()
+
 # initialize the agent
 agent_executor = initialize_agent()
 app.agent_executor = agent_executor
@@ -262,11 +265,9 @@ def delete_contract(contract_id):
             if not contract:
                 return jsonify({"error": "Contract not found"}), 404
             
-            # stop monitoring thread if exists
-            if contract_id in contract_monitor.monitors:
-                # Note: You might need to implement a stop method in your monitor thread
-                logger.info(f"Stopping monitor for contract {contract_id}")
-                contract_monitor.monitors.pop(contract_id)
+            # stop monitoring task if exists, the monitor also drops the stored watermark
+            logger.info(f"Stopping monitor for contract {contract_id}")
+            contract_monitor.stop_monitoring(contract_id)
             
             # delete related records
             session.query(AlertEmail).filter_by(contract_id=contract_id).delete()
@@ -1,12 +1,22 @@
-from web3 import Web3
+from web3 import AsyncWeb3, AsyncHTTPProvider, Web3, WebSocketProvider
 import os
-import time
+import asyncio
 import threading
-from db.models import Contract, Alert, AlertEmail
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from urllib.parse import urlparse
+import aiohttp
+import numpy as np
+from sqlalchemy import insert, select, update
+from db.models import Contract, Alert, AlertEmail, MonitorState
 import logging
 from eth_utils import to_checksum_address
-from web3.exceptions import BlockNotFound
-from agent.custom_actions.get_last_transactions import get_last_transactions, format_transaction_log
+from web3.exceptions import BlockNotFound, Web3Exception
+from web3.providers.rpc.utils import ExceptionRetryConfiguration
+from hexbytes import HexBytes
+from utils.email_service import send_alert_email
+from agent.custom_actions.get_last_transactions import get_network_config, get_transaction_hashes
 
 # Configure logging
 logging.basicConfig(
@@ -16,16 +26,118 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+MAX_UINT64 = 2 ** 64 - 1
+
+# threat thresholds, compared as plain integers
+HIGH_VALUE_WEI = 10 * 10 ** 18  # 10 ETH
+HIGH_GAS = 1_000_000
+
+# providers cap eth_getLogs block ranges, query at most this many blocks at once
+LOG_CHUNK_SIZE = 2000
+LOG_CHUNKS_PER_BATCH = 10
+
+# fetched (tx, receipt) pairs kept so overlapping scans do not refetch them
+TX_CACHE_SIZE = 4096
+
+# blocks with at least this many contract transactions are fetched whole
+DENSE_BLOCK_TXS = 3
+
+# explorers index new blocks with a lag, scans stay this many blocks behind the head
+# when they use one. the free tier allows 5 requests per second, keep few in flight
+EXPLORER_LAG_BLOCKS = 12
+EXPLORER_MAX_CONCURRENT = 2
+
+# hosted RPCs cap JSON-RPC batch sizes, never send more calls than this at once.
+# a whole block comes with all its receipts, often over a megabyte, so few share a batch
+MAX_BATCH_CALLS = 200
+MAX_BATCH_BLOCKS = 4
+
+# log subscriptions: delay to group pushed logs into one scan, reconnect backoff bounds
+SUBSCRIPTION_BATCH_DELAY = 0.5
+SUBSCRIPTION_MIN_BACKOFF = 1
+SUBSCRIPTION_MAX_BACKOFF = 60
+
+# scheduler: scans running at once, longest idle wait between checks for due contracts,
+# pause before restarting a crashed scheduler
+MAX_CONCURRENT_SCANS = 16
+SCHEDULER_MAX_WAIT = 60
+SCHEDULER_RESTART_DELAY = 5
+
+@lru_cache(maxsize=1024)
+def _checksum(address):
+    """Checksum an address, cached since monitored addresses never change"""
+    return to_checksum_address(address)
+
 class ContractMonitor:
+    # monitoring frequency -> seconds between checks
+    FREQUENCY_MAP = {
+        '1min': 60,
+        '5min': 300,
+        '15min': 900,
+        '30min': 1800,
+        '1hour': 3600
+    }
+    
     def __init__(self, db_session):
         self.db_session = db_session
         self.monitors = {}
-        self.stop_flags = {} 
         self.last_processed_block = {}
+        self._code_exists = {}
+        self._explorer_warned = set()
+        self._explorer_limit = asyncio.Semaphore(EXPLORER_MAX_CONCURRENT)
+        self._sessions = {}
+        self._web3_cache = {}
+        # network -> idle web3 instances reserved for JSON-RPC batches
+        self._batch_web3 = {}
+        self._tx_cache = OrderedDict()
+        # ws_url -> one shared log subscription socket for all its contracts
+        self._ws_watchers = {}
+        self._loop = None
+        self._scheduler = None
+        self._loop_lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self._workers = asyncio.Semaphore(MAX_CONCURRENT_SCANS)
         logger = logging.getLogger('contract_monitor')
         logger.info("Contract monitor initialized and ready to track contracts")
     
-    def get_web3(self, network):
+    def _ensure_loop(self):
+        """Start the event loop thread and the scheduler shared by all contract monitors"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name="contract-monitor-loop"
+                )
+                thread.daemon = True
+                thread.start()
+                self._start_scheduler()
+        return self._loop
+    
+    def _start_scheduler(self):
+        # keep the future, a scheduler that died silently would stop every monitor
+        self._scheduler = asyncio.run_coroutine_threadsafe(self._run_scheduler(), self._loop)
+        self._scheduler.add_done_callback(self._on_scheduler_done)
+    
+    def _on_scheduler_done(self, future):
+        """Log why the scheduler stopped and start it again"""
+        if future.cancelled():
+            return
+        logger.error(f"Contract monitor scheduler stopped: {str(future.exception())}")
+        # restart after a pause so a persistent error doesn't spin
+        self._loop.call_soon_threadsafe(
+            self._loop.call_later, SCHEDULER_RESTART_DELAY, self._start_scheduler
+        )
+    
+    async def get_web3(self, network):
+        """Shared web3 for single calls, cached per network"""
+        if network in self._web3_cache:
+            return self._web3_cache[network]
+        
+        web3 = await self._create_web3(network)
+        return self._web3_cache.setdefault(network, web3)
+    
+    async def _create_web3(self, network):
         providers = {
             'ethereum': os.getenv('ETH_RPC_URL', 'https://eth-mainnet.g.alchemy.com/v2/api-key'),
             'base': os.getenv('BASE_RPC_URL', 'https://mainnet.base.org'),
@@ -39,179 +151,687 @@ class ContractMonitor:
             raise ValueError(f"No RPC URL configured for network: {network}")
             
         logger.info(f"Connecting to {network} network at {provider_url}")
-        return Web3(Web3.HTTPProvider(provider_url))
+        
+        # networks served by the same RPC host share one pooled aiohttp session
+        host = urlparse(provider_url).netloc
+        session = self._sessions.get(host)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=64))
+            self._sessions[host] = session
+        
+        provider = AsyncHTTPProvider(
+            provider_url,
+            request_kwargs={'timeout': aiohttp.ClientTimeout(total=30)},
+            exception_retry_configuration=ExceptionRetryConfiguration(
+                errors=(aiohttp.ClientError, asyncio.TimeoutError),
+                retries=3,
+                backoff_factor=0.2
+            )
+        )
+        await provider.cache_async_session(session)
+        return AsyncWeb3(provider)
     
-    def get_contract_transactions(self, web3, contract_address, from_block, to_block):
-        """Get all transactions involving the contract"""
+    @asynccontextmanager
+    async def batch_requests(self, network):
+        """Open a JSON-RPC batch on a provider of its own, yields (web3, batch)"""
+        # web3 keeps the batching state on the provider, a batch on the shared one
+        # would turn the concurrent calls of every other scan into batch entries
+        idle = self._batch_web3.setdefault(network, [])
+        web3 = idle.pop() if idle else await self._create_web3(network)
         try:
-            # get transactions where contract is recipient
-            to_contract = web3.eth.get_logs({
-                'fromBlock': from_block,
-                'toBlock': to_block,
-                'address': contract_address
-            })
-            
-            # get transactions where contract is sender
-            from_contract = web3.eth.get_logs({
-                'fromBlock': from_block,
-                'toBlock': to_block,
-                'topics': [None],  # Any event
-                'address': contract_address
-            })
-            
-            return to_contract + from_contract
-            
+            async with web3.batch_requests() as batch:
+                yield web3, batch
+        finally:
+            idle.append(web3)
+    
+    async def contract_has_code(self, web3, network, contract_address):
+        """Check whether code is deployed at the address, cached per network"""
+        key = (network, contract_address)
+        if self._code_exists.get(key):
+            return True
+        
+        # a cached miss is looked up again so a not yet deployed address is picked up
+        has_code = len(await web3.eth.get_code(contract_address)) > 0
+        self._code_exists[key] = has_code
+        return has_code
+    
+    async def get_contract_transactions(self, web3, network, contract_address, from_block, to_block):
+        """
+        Yield (from_block, to_block, transactions) for each chunk group of the range,
+        with one entry per transaction touching the contract
+        """
+        try:
+            async for group_from, group_to, logs in self.iter_contract_logs(
+                web3, network, contract_address, from_block, to_block
+            ):
+                # logs are emitted by the contract regardless of the caller, so there is
+                # no separate "contract as sender" query to make, keep the first log
+                # of each transaction
+                unique_txs = {}
+                for log in logs:
+                    unique_txs.setdefault(log['transactionHash'], log)
+                
+                # reverted transactions and plain transfers emit no logs, take them from the explorer
+                for tx in await self.get_explorer_transactions(network, contract_address, group_from, group_to):
+                    unique_txs.setdefault(HexBytes(tx['hash']), {
+                        'transactionHash': HexBytes(tx['hash']),
+                        'blockNumber': tx['block_number']
+                    })
+                
+                yield group_from, group_to, list(unique_txs.values())
         except BlockNotFound:
             logger.warning(f"Block range {from_block}-{to_block} not available, adjusting range")
+    
+    def has_explorer(self, network):
+        """Whether an explorer API key is configured for the network"""
+        return bool(get_network_config(network).get('api_key'))
+    
+    async def get_explorer_transactions(self, network, contract_address, from_block, to_block):
+        """Get the explorer's transaction list for the range, empty when no explorer is configured"""
+        if not self.has_explorer(network):
+            if network not in self._explorer_warned:
+                self._explorer_warned.add(network)
+                logger.warning(
+                    f"No explorer API key configured for {network}, "
+                    "failed transactions and transfers without logs are not detected"
+                )
             return []
+        
+        # errors are raised, the scan backs off without moving the watermark past these blocks
+        async with self._explorer_limit:
+            # the explorer client is blocking, keep it off the event loop
+            return await asyncio.to_thread(
+                get_transaction_hashes,
+                contract_address,
+                network,
+                from_block,
+                to_block
+            )
+    
+    async def iter_contract_logs(self, web3, network, contract_address, from_block, to_block):
+        """Yield (from_block, to_block, logs) per group of capped block-range chunks"""
+        ranges = [
+            (start, min(start + LOG_CHUNK_SIZE - 1, to_block))
+            for start in range(from_block, to_block + 1, LOG_CHUNK_SIZE)
+        ]
+        
+        for i in range(0, len(ranges), LOG_CHUNKS_PER_BATCH):
+            group = ranges[i:i + LOG_CHUNKS_PER_BATCH]
+            results = None
+            
+            if len(group) > 1:
+                # several chunks go out in one JSON-RPC batch
+                try:
+                    async with self.batch_requests(network) as (batch_web3, batch):
+                        for start, end in group:
+                            batch.add(batch_web3.eth.get_logs(self._log_filter(contract_address, start, end)))
+                        results = await batch.async_execute()
+                except (ValueError, Web3Exception) as e:
+                    logger.warning(f"Batched log query failed ({str(e)}), retrying per chunk")
+            
+            if results is None:
+                # per chunk queries split any range the provider rejects
+                results = [
+                    await self.get_logs_adaptive(web3, contract_address, start, end)
+                    for start, end in group
+                ]
+            
+            yield group[0][0], group[-1][1], [log for logs in results for log in logs]
+    
+    async def get_logs_adaptive(self, web3, contract_address, from_block, to_block):
+        """Get logs for a block range, halving it while the provider rejects the query"""
+        try:
+            return await web3.eth.get_logs(self._log_filter(contract_address, from_block, to_block))
+        except (ValueError, Web3Exception) as e:
+            # e.g. "query returned more than 10000 results"
+            if from_block >= to_block:
+                raise
+            middle = (from_block + to_block) // 2
+            logger.warning(f"Log query for blocks {from_block}-{to_block} rejected ({str(e)}), splitting range")
+            return (
+                await self.get_logs_adaptive(web3, contract_address, from_block, middle) +
+                await self.get_logs_adaptive(web3, contract_address, middle + 1, to_block)
+            )
+    
+    def _log_filter(self, contract_address, from_block, to_block):
+        return {
+            'fromBlock': from_block,
+            'toBlock': to_block,
+            'address': contract_address
+        }
+    
+    async def fetch_transactions(self, network, logs):
+        """Fetch transaction details and receipts for the logged transactions"""
+        # single pass over the entries, already unique per transaction (see
+        # get_contract_transactions), hashes stay raw bytes (no .hex())
+        tx_hashes = []
+        missing = {}
+        # hits are copied out now, another scan may evict them while we await
+        found = {}
+        for log in logs:
+            tx_hash = log['transactionHash']
+            tx_hashes.append(tx_hash)
+            cached = self._tx_cache.get((network, tx_hash))
+            if cached is not None:
+                found[tx_hash] = cached
+            else:
+                missing.setdefault(log['blockNumber'], set()).add(tx_hash)
+        
+        fetched = {}
+        if missing:
+            dense_blocks = {
+                block_number for block_number, hashes in missing.items()
+                if len(hashes) >= DENSE_BLOCK_TXS
+            }
+            try:
+                fetched = await self._fetch_missing(network, missing, dense_blocks)
+            except (ValueError, Web3Exception, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not dense_blocks:
+                    raise
+                # eth_getBlockReceipts is not supported by every provider and whole
+                # blocks can be too large to arrive within the timeout
+                logger.warning(f"Block level fetch failed ({str(e) or type(e).__name__}), retrying per transaction")
+                fetched = await self._fetch_missing(network, missing, set())
+            found.update(fetched)
+        
+        transactions = [found[tx_hash] for tx_hash in tx_hashes if tx_hash in found]
+        
+        # only touch the shared cache once the result is built
+        for tx_hash, pair in found.items():
+            key = (network, tx_hash)
+            self._tx_cache[key] = pair
+            self._tx_cache.move_to_end(key)
+        
+        # evict the least recently used entries
+        while len(self._tx_cache) > TX_CACHE_SIZE:
+            self._tx_cache.popitem(last=False)
+        
+        return transactions
     
-    def analyze_transaction(self, web3, tx):
-        """Analyze a transaction for potential threats"""
+    async def _fetch_missing(self, network, missing, dense_blocks):
+        """Fetch missing transactions in bounded JSON-RPC batches, whole blocks for dense ones"""
+        fetched = {}
+        blocks = [('block', block_number) for block_number in missing if block_number in dense_blocks]
+        txs = [
+            ('tx', tx_hash)
+            for block_number, hashes in missing.items() if block_number not in dense_blocks
+            for tx_hash in hashes
+        ]
+        
+        # every lookup is two calls, blocks get their own smaller cap
+        per_batch = MAX_BATCH_CALLS // 2
+        parts = [blocks[i:i + MAX_BATCH_BLOCKS] for i in range(0, len(blocks), MAX_BATCH_BLOCKS)]
+        parts += [txs[i:i + per_batch] for i in range(0, len(txs), per_batch)]
+        
+        for part in parts:
+            async with self.batch_requests(network) as (batch_web3, batch):
+                for kind, key in part:
+                    if kind == 'block':
+                        batch.add(batch_web3.eth.get_block(key, full_transactions=True))
+                        batch.add(batch_web3.eth.get_block_receipts(key))
+                    else:
+                        batch.add(batch_web3.eth.get_transaction(key))
+                        batch.add(batch_web3.eth.get_transaction_receipt(key))
+                responses = await batch.async_execute()
+            
+            # responses come back in request order as pairs
+            for (kind, key), first, second in zip(part, responses[0::2], responses[1::2]):
+                if kind == 'tx':
+                    fetched[key] = (first, second)
+                    continue
+                
+                wanted = missing[key]
+                receipts_by_hash = {receipt['transactionHash']: receipt for receipt in second}
+                for tx_details in first['transactions']:
+                    if tx_details['hash'] in wanted:
+                        fetched[tx_details['hash']] = (
+                            tx_details,
+                            receipts_by_hash.get(tx_details['hash'])
+                        )
+        
+        return fetched
+    
+    def analyze_transactions(self, transactions):
+        """Analyze fetched (tx_details, receipt) pairs for potential threats"""
         threats = []
         logger = logging.getLogger('contract_monitor')
         
         try:
-            tx_hash = tx.get('transactionHash', '').hex()
-            if tx_hash:
-                logger.info(f"Analyzing transaction: {tx_hash}")
-                
-                tx_details = web3.eth.get_transaction(tx_hash)
-                receipt = web3.eth.get_transaction_receipt(tx_hash)
-                
-                # log transaction details
-                logger.info(f"Transaction value: {web3.from_wei(tx_details.get('value', 0), 'ether')} ETH")
-                logger.info(f"Gas used: {receipt.get('gasUsed', 0) if receipt else 'unknown'}")
-                
-                # check for high value transfers
-                if tx_details.get('value', 0) > web3.to_wei(10, 'ether'):
-                    threat_msg = f'High value transfer: {web3.from_wei(tx_details["value"], "ether")} ETH'
-                    logger.warning(threat_msg)
-                    threats.append({
-                        'type': 'high_value_transfer',
-                        'description': threat_msg
-                    })
-                
-                # check for failed transactions
-                if receipt and receipt.get('status') == 0:
-                    threat_msg = f'Failed transaction detected: {tx_hash}'
-                    logger.warning(threat_msg)
-                    threats.append({
-                        'type': 'failed_transaction',
-                        'description': threat_msg
-                    })
-                
-                # check for high gas usage
-                if receipt and receipt.get('gasUsed', 0) > 1000000:
-                    threat_msg = f'High gas usage: {receipt["gasUsed"]} gas'
-                    logger.warning(threat_msg)
-                    threats.append({
-                        'type': 'high_gas_usage',
-                        'description': threat_msg
-                    })
-                
-                if not threats:
-                    logger.info("No threats detected in transaction")
-                
+            threats.extend(self._iter_threats(transactions))
         except Exception as e:
-            logger.error(f"Error analyzing transaction: {str(e)}")
+            logger.error(f"Error analyzing transactions: {str(e)}")
         
         return threats
     
-    def monitor_contract(self, contract_id):
+    def _iter_threats(self, transactions):
+        """Yield a threat for every check a transaction trips, cheapest checks first"""
+        if not transactions:
+            return
+        
         logger = logging.getLogger('contract_monitor')
-        logger = logging.LoggerAdapter(logger, {'contract_id': contract_id})
         
-        logger.info(f"Starting monitoring service for contract ID: {contract_id}")
+        # per transaction details are only worth formatting when debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            for tx_details, receipt in transactions:
+                logger.debug(
+                    f"Transaction {Web3.to_hex(tx_details['hash'])}: "
+                    f"value {tx_details.get('value', 0)} wei, "
+                    f"gas used {receipt.get('gasUsed', 0) if receipt else 'unknown'}"
+                )
+        
+        count = len(transactions)
+        status = np.fromiter(
+            (receipt.get('status', 1) if receipt else 1 for _, receipt in transactions),
+            dtype=np.int64,
+            count=count
+        )
+        gas_used = np.fromiter(
+            (receipt.get('gasUsed', 0) if receipt else 0 for _, receipt in transactions),
+            dtype=np.int64,
+            count=count
+        )
+        # wei values can overflow 64 bits, clamping keeps the threshold comparison exact
+        values = np.fromiter(
+            (min(tx_details.get('value', 0), MAX_UINT64) for tx_details, _ in transactions),
+            dtype=np.uint64,
+            count=count
+        )
+        
+        failed = status == 0
+        high_gas = gas_used > HIGH_GAS
+        high_value = values > np.uint64(HIGH_VALUE_WEI)
         
+        flagged = np.flatnonzero(failed | high_gas | high_value)
+        # benign traffic, nothing to build
+        if flagged.size == 0:
+            return
+        
+        # only build messages for the transactions that tripped a check
+        for i in flagged:
+            tx_details, receipt = transactions[i]
+            
+            # check for failed transactions
+            if failed[i]:
+                threat_msg = f'Failed transaction detected: {Web3.to_hex(tx_details["hash"])}'
+                logger.warning(threat_msg)
+                yield {
+                    'type': 'failed_transaction',
+                    'description': threat_msg
+                }
+            
+            # check for high gas usage
+            if high_gas[i]:
+                threat_msg = f'High gas usage: {receipt["gasUsed"]} gas'
+                logger.warning(threat_msg)
+                yield {
+                    'type': 'high_gas_usage',
+                    'description': threat_msg
+                }
+            
+            # check for high value transfers
+            if high_value[i]:
+                threat_msg = f'High value transfer: {Web3.from_wei(tx_details["value"], "ether")} ETH'
+                logger.warning(threat_msg)
+                yield {
+                    'type': 'high_value_transfer',
+                    'description': threat_msg
+                }
+    
+    async def _run_scheduler(self):
+        """Single timer loop that starts the scan of every contract that is due"""
+        loop = asyncio.get_running_loop()
         while True:
+            now = loop.time()
+            next_due = now + SCHEDULER_MAX_WAIT
+            
+            for contract_id, job in list(self.monitors.items()):
+                if job['running']:
+                    continue
+                if job['next_run'] <= now:
+                    job['running'] = True
+                    job['triggered'] = False
+                    job['task'] = asyncio.create_task(self._run_job(contract_id, job))
+                else:
+                    next_due = min(next_due, job['next_run'])
+            
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), next_due - now)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _run_job(self, contract_id, job):
+        """Run one scan on the shared worker pool and schedule the next one"""
+        keep = True
+        delay = None
+        async with self._workers:
             try:
-                with self.db_session() as session:
-                    contract = session.query(Contract).get(contract_id)
-                    if not contract:
-                        logger.warning(f"Contract {contract_id} not found, stopping monitor")
-                        break
+                keep = await self._scan_once(contract_id, job)
+            except Exception as e:
+                logger.error(f"Error in monitoring loop for contract {contract_id}: {str(e)}")
+                delay = 60
+        job['running'] = False
+        
+        if not keep:
+            if self.monitors.get(contract_id) is job:
+                self.stop_monitoring(contract_id)
+            return
+        
+        if delay is not None:
+            # a failed scan keeps its backoff even when logs were pushed meanwhile
+            logger.info(f"Retrying contract {contract_id} in {delay} seconds")
+        elif job['triggered']:
+            # logs were pushed while scanning, coalesce them into one more scan
+            delay = SUBSCRIPTION_BATCH_DELAY
+        else:
+            # pushed logs trigger scans sooner, the interval stays as a fallback poll
+            delay = job['interval']
+            logger.info(f"Next check for contract {contract_id} in {delay} seconds")
+        
+        job['next_run'] = asyncio.get_running_loop().time() + delay
+        self._wakeup.set()
+    
+    async def _scan_once(self, contract_id, job):
+        """Scan a contract's new blocks once, False when the contract no longer exists"""
+        logger = logging.getLogger('contract_monitor')
+        logger = logging.LoggerAdapter(logger, {'contract_id': contract_id})
+        
+        # stopped after the scheduler picked it up
+        if self.monitors.get(contract_id) is not job:
+            return True
+        
+        with self.db_session() as session:
+            # only the columns the monitor reads, not the full ORM row
+            contract = session.execute(
+                select(
+                    Contract.id,
+                    Contract.address,
+                    Contract.network,
+                    Contract.monitoring_frequency,
+                    Contract.threat_level
+                ).where(Contract.id == contract_id)
+            ).one_or_none()
+            if not contract:
+                logger.warning(f"Contract {contract_id} not found, stopping monitor")
+                return False
 
-                    logger.info(f"Monitoring contract {contract.address} on {contract.network}")
-                    
-                    # get last 10 transactions
-                    transactions = get_last_transactions(contract.address, contract.network)
-                    
-                    if transactions:
-                        logger.info(f"Retrieved {len(transactions)} recent transactions")
-                        for tx in transactions:
-                            logger.info(format_transaction_log(tx))
-                            
-                            # Analyze transaction for threats
-                            if tx['is_error']:
-                                logger.warning(f"Failed transaction detected: {tx['hash']}")
-                            
-                            if float(tx['value']) > 10:  # More than 10 ETH
-                                logger.warning(f"High value transfer detected: {tx['value']} ETH")
-                            
-                            if int(tx['gas_used']) > 1000000:  # High gas usage
-                                logger.warning(f"High gas usage detected: {tx['gas_used']}")
-                    else:
-                        logger.info("No recent transactions found")
+            logger.info(f"Monitoring contract {contract.address} on {contract.network}")
+            
+            # resume from the stored watermark after a restart
+            if contract_id not in self.last_processed_block:
+                state = session.get(MonitorState, contract_id)
+                if state:
+                    self.last_processed_block[contract_id] = state.last_processed_block
+            
+            # only re-parse the frequency when it changed
+            if contract.monitoring_frequency != job['frequency']:
+                job['frequency'] = contract.monitoring_frequency
+                job['interval'] = self.get_sleep_time(job['frequency'])
+            
+            web3 = await self.get_web3(contract.network)
+            contract_address = _checksum(contract.address)
+            
+            if not await self.contract_has_code(web3, contract.network, contract_address):
+                logger.warning(f"No contract code found at {contract_address}")
+                return True
+            
+            current_block = await web3.eth.block_number
+            if self.has_explorer(contract.network):
+                # blocks the explorer has not indexed yet would be committed without its transactions
+                current_block -= EXPLORER_LAG_BLOCKS
+            last_block = self.last_processed_block.get(contract_id)
+            from_block = last_block + 1 if last_block is not None else current_block - 100
+            
+            # each chunk group is processed and committed on its own so memory stays
+            # bounded and a long catch-up keeps its progress
+            async for group_from, group_to, txs in self.get_contract_transactions(
+                web3, contract.network, contract_address, from_block, current_block
+            ):
+                transactions = await self.fetch_transactions(contract.network, txs)
+                all_threats = self.analyze_transactions(transactions)
+                logger.info(
+                    f"Scanned {len(transactions)} transactions in blocks "
+                    f"{group_from}-{group_to}, {len(all_threats)} threats"
+                )
+                
+                # stopped while we were fetching, the id may already be reused
+                if self.monitors.get(contract_id) is not job:
+                    logger.info(f"Contract {contract_id} no longer monitored, discarding scan")
+                    return True
+                
+                if all_threats:
+                    session.execute(insert(Alert), [{
+                        'contract_id': contract.id,
+                        'type': threat['type'],
+                        'description': threat['description']
+                    } for threat in all_threats])
+                    if contract.threat_level == 'Low':
+                        session.execute(
+                            update(Contract)
+                            .where(Contract.id == contract.id)
+                            .values(status='Warning', threat_level='Medium')
+                        )
+                
+                # the watermark is committed together with the alerts
+                session.merge(MonitorState(
+                    contract_id=contract.id,
+                    last_processed_block=group_to
+                ))
+                session.commit()
+                self.last_processed_block[contract_id] = group_to
+                
+                if all_threats:
+                    await self.send_notifications(session, contract, all_threats)
+            
+            ws_url = self.get_ws_url(contract.network)
+            if ws_url and job['ws'] is None and self.monitors.get(contract_id) is job:
+                self._watch_contract(ws_url, contract_address, contract_id, job)
+        
+        return True
+    
+    def _trigger(self, job):
+        """Schedule a scan soon, logs arriving close together share it"""
+        job['triggered'] = True
+        job['next_run'] = min(
+            job['next_run'],
+            asyncio.get_running_loop().time() + SUBSCRIPTION_BATCH_DELAY
+        )
+        self._wakeup.set()
+    
+    def get_ws_url(self, network):
+        """Websocket RPC url for log subscriptions, None when the network is only polled"""
+        ws_urls = {
+            'ethereum': os.getenv('ETH_WS_URL'),
+            'base': os.getenv('BASE_WS_URL'),
+            'base-sepolia': os.getenv('BASE_SEPOLIA_WS_URL')
+        }
+        return ws_urls.get(network) or None
+    
+    def _watch_contract(self, ws_url, contract_address, contract_id, job):
+        """Register a contract on the shared subscription socket of its ws_url"""
+        watcher = self._ws_watchers.get(ws_url)
+        if watcher is None:
+            watcher = {'jobs': {}, 'subscriptions': {}, 'web3': None, 'task': None, 'pending': set()}
+            self._ws_watchers[ws_url] = watcher
+            watcher['task'] = asyncio.create_task(self.watch_logs(ws_url, watcher))
+        
+        watcher['jobs'].setdefault(contract_address, {})[contract_id] = job
+        job['ws'] = (ws_url, contract_address)
+        
+        # already connected, add the address to the open socket
+        if watcher['web3'] is not None and contract_address not in watcher['subscriptions']:
+            task = asyncio.create_task(self._subscribe(watcher, contract_address))
+            # the loop only keeps weak references to tasks
+            watcher['pending'].add(task)
+            task.add_done_callback(watcher['pending'].discard)
+    
+    async def _unwatch_contract(self, contract_id, job):
+        """Remove a stopped contract from its subscription socket"""
+        if job['ws'] is None:
+            return
+        ws_url, contract_address = job['ws']
+        job['ws'] = None
+        watcher = self._ws_watchers.get(ws_url)
+        if watcher is None:
+            return
+        
+        jobs = watcher['jobs'].get(contract_address, {})
+        if jobs.get(contract_id) is job:
+            del jobs[contract_id]
+        if jobs:
+            return
+        watcher['jobs'].pop(contract_address, None)
+        
+        # last contract on this url, closing the socket drops every subscription
+        if not watcher['jobs']:
+            del self._ws_watchers[ws_url]
+            watcher['task'].cancel()
+            for task in list(watcher['pending']):
+                task.cancel()
+            return
+        
+        subscription_id = watcher['subscriptions'].pop(contract_address, None)
+        if subscription_id and watcher['web3'] is not None:
+            try:
+                await watcher['web3'].eth.unsubscribe(subscription_id)
+            except Exception as e:
+                logger.warning(f"Failed to unsubscribe from logs of {contract_address}: {str(e)}")
+    
+    async def _subscribe(self, watcher, contract_address):
+        """Subscribe to one contract's logs on the open socket"""
+        ws_web3 = watcher['web3']
+        # mark it pending so it is not subscribed twice
+        watcher['subscriptions'][contract_address] = None
+        try:
+            subscription_id = await ws_web3.eth.subscribe('logs', {'address': contract_address})
+            # stopped while subscribing
+            if contract_address not in watcher['jobs']:
+                watcher['subscriptions'].pop(contract_address, None)
+                await ws_web3.eth.unsubscribe(subscription_id)
+                return
+        except Exception as e:
+            logger.error(f"Log subscription for {contract_address} failed: {str(e)}")
+            watcher['subscriptions'].pop(contract_address, None)
+            return
+        
+        watcher['subscriptions'][contract_address] = subscription_id
+        logger.info(f"Subscribed to logs of {contract_address}")
+    
+    async def watch_logs(self, ws_url, watcher):
+        """Keep one websocket open per url and trigger the scan of every contract a pushed log belongs to"""
+        host = urlparse(ws_url).hostname
+        backoff = SUBSCRIPTION_MIN_BACKOFF
+        while True:
+            try:
+                async with AsyncWeb3(WebSocketProvider(ws_url)) as ws_web3:
+                    watcher['web3'] = ws_web3
+                    watcher['subscriptions'] = {}
+                    for contract_address in list(watcher['jobs']):
+                        if contract_address not in watcher['subscriptions']:
+                            await self._subscribe(watcher, contract_address)
+                    backoff = SUBSCRIPTION_MIN_BACKOFF
                     
-                    # sleep until next check
-                    sleep_time = self.get_sleep_time(contract.monitoring_frequency)
-                    logger.info(f"Next check in {sleep_time} seconds")
-                    time.sleep(sleep_time)
+                    # scan once after (re)connecting to catch up on missed blocks
+                    for jobs in list(watcher['jobs'].values()):
+                        for job in list(jobs.values()):
+                            self._trigger(job)
                     
+                    async for payload in ws_web3.socket.process_subscriptions():
+                        contract_address = _checksum(payload['result']['address'])
+                        for job in list(watcher['jobs'].get(contract_address, {}).values()):
+                            self._trigger(job)
             except Exception as e:
-                logger.error(f"Error in monitoring loop: {str(e)}")
-                time.sleep(60)
+                logger.error(f"Log subscription socket to {host} failed: {str(e)}")
+            finally:
+                watcher['web3'] = None
+            
+            # scans keep running on their polling interval while the socket is down
+            logger.info(f"Reconnecting log subscriptions to {host} in {backoff} seconds")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, SUBSCRIPTION_MAX_BACKOFF)
     
-    def send_notifications(self, session, contract, threats):
+    async def send_notifications(self, session, contract, threats):
         """Send email notifications for detected threats"""
         try:
-            emails = session.query(AlertEmail).filter_by(contract_id=contract.id).all()
-            for email in emails:
-                try:
-                    message = (
-                        f'Security threats detected for contract {contract.address}:\n\n' +
-                        '\n'.join([f"- {t['type']}: {t['description']}" for t in threats])
-                    )
-                    send_alert_email(
-                        email.email,
-                        'Contract Security Alert',
-                        message
-                    )
-                    logger.info(f"Sent alert email to {email.email}")
-                except Exception as e:
-                    logger.error(f"Failed to send email to {email.email}: {str(e)}")
+            emails = session.query(AlertEmail.email).filter(
+                AlertEmail.contract_id == contract.id
+            ).all()
+            
+            # the message is the same for every recipient
+            message = (
+                f'Security threats detected for contract {contract.address}:\n\n' +
+                '\n'.join([f"- {t['type']}: {t['description']}" for t in threats])
+            )
+            await asyncio.gather(*(self.send_email(email[0], message) for email in emails))
         except Exception as e:
             logger.error(f"Error sending notifications: {str(e)}")
     
+    async def send_email(self, to_email, message):
+        """Send a single alert email without blocking the event loop"""
+        try:
+            # smtp is blocking, run it in the default thread pool
+            await asyncio.to_thread(
+                send_alert_email,
+                to_email,
+                'Contract Security Alert',
+                message
+            )
+            logger.info(f"Sent alert email to {to_email}")
+        except Exception as e:
+            logger.error(f"Failed to send email to {to_email}: {str(e)}")
+    
     def get_sleep_time(self, frequency):
         """Convert monitoring frequency to sleep seconds"""
-        frequency_map = {
-            '1min': 60,
-            '5min': 300,
-            '15min': 900,
-            '30min': 1800,
-            '1hour': 3600
-        }
-        return frequency_map.get(frequency, 300)
+        return self.FREQUENCY_MAP.get(frequency, 300)
     
     def start_monitoring(self, contract_id):
         if contract_id not in self.monitors:
-            logger.info(f"Starting new monitor thread for contract {contract_id}")
-            thread = threading.Thread(
-                target=self.monitor_contract,
-                args=(contract_id,),
-                name=f"contract-monitor-{contract_id}"
-            )
-            thread.daemon = True
-            thread.start()
-            self.monitors[contract_id] = thread
-            logger.info(f"Monitor thread started for contract {contract_id}")
+            logger.info(f"Scheduling monitor for contract {contract_id}")
+            loop = self._ensure_loop()
+            self.monitors[contract_id] = {
+                'frequency': None,
+                'interval': self.get_sleep_time(None),
+                'next_run': 0,
+                'running': False,
+                'triggered': False,
+                'task': None,
+                'ws': None
+            }
+            loop.call_soon_threadsafe(self._wakeup.set)
+            logger.info(f"Monitor scheduled for contract {contract_id}")
         else:
             logger.warning(f"Monitor already exists for contract {contract_id}")
     
+    def resume_monitoring(self):
+        """Start monitoring every stored contract, scans continue from the stored watermark"""
+        with self.db_session() as session:
+            contract_ids = session.execute(select(Contract.id)).scalars().all()
+        for contract_id in contract_ids:
+            self.start_monitoring(contract_id)
+    
     def stop_monitoring(self, contract_id):
-        """Stop monitoring a specific contract"""
-        if contract_id in self.monitors:
-            self.stop_flags[contract_id] = True
-            self.monitors.pop(contract_id, None)
-            logger.info(f"Stopped monitoring contract {contract_id}") 
\ No newline at end of file
+        """Stop monitoring a specific contract and forget its watermark"""
+        job = self.monitors.pop(contract_id, None)
+        
+        # SQLite reuses ids, a new contract must not inherit this watermark. a scan checks
+        # its job and commits without yielding, so on the loop this runs after any commit
+        # that raced the stop
+        if self._loop is None:
+            self._forget_state(contract_id)
+        else:
+            self._loop.call_soon_threadsafe(self._forget_state, contract_id)
+        
+        if job:
+            # always scheduled, a running scan may still be registering it
+            asyncio.run_coroutine_threadsafe(self._unwatch_contract(contract_id, job), self._loop)
+            logger.info(f"Stopped monitoring contract {contract_id}")
+    
+    def _forget_state(self, contract_id):
+        """Drop the in-memory and stored watermark of a contract"""
+        self.last_processed_block.pop(contract_id, None)
+        try:
+            with self.db_session() as session:
+                session.query(MonitorState).filter_by(contract_id=contract_id).delete()
+                session.commit()
+        except Exception as e:
+            logger.error(f"Failed to clear monitor state for contract {contract_id}: {str(e)}")
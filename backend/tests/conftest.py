@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the backend is run from its own directory, imports are relative to it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
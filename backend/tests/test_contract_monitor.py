@@ -0,0 +1,642 @@
+import asyncio
+import threading
+
+import pytest
+from hexbytes import HexBytes
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import monitoring.contract_monitor as contract_monitor
+from db.models import Base, Contract, Alert, MonitorState
+from monitoring.contract_monitor import ContractMonitor, _checksum
+
+ADDRESS = '0x7a250d5630b4cf539739df2c5dacb4c659f2488d'
+OTHER_ADDRESS = '0x0000000000000000000000000000000000000001'
+WS_URL = 'wss://node.example/key'
+CURRENT_BLOCK = 120
+
+
+def tx_hash(i):
+    return HexBytes(bytes([i % 256, i // 256]) * 16)
+
+
+class FakeCall:
+    """Awaitable RPC call that the fake batch can also run"""
+    def __init__(self, web3, method, fn):
+        self.web3 = web3
+        self.method = method
+        self.fn = fn
+
+    def __await__(self):
+        async def run():
+            # like web3, a call on a provider that is batching only returns its request info
+            if self.web3.is_batching:
+                return ((self.method, ()), ())
+            return self.fn()
+        return run().__await__()
+
+
+class FakeBatch:
+    def __init__(self, web3):
+        self.web3 = web3
+        self.calls = []
+
+    async def __aenter__(self):
+        self.web3.is_batching = True
+        return self
+
+    async def __aexit__(self, *exc):
+        self.web3.is_batching = False
+
+    def add(self, call):
+        self.calls.append(call)
+
+    async def async_execute(self):
+        # the response arrives later, other scans run meanwhile
+        await asyncio.sleep(0)
+        self.web3.chain.batch_sizes.append(len(self.calls))
+        self.web3.is_batching = False
+        return [call.fn() for call in self.calls]
+
+
+class FakeChain:
+    """In-memory node shared by every provider, tx 1 moves a high value and tx 2 reverts"""
+    def __init__(self, tx_count=2):
+        self.current_block = CURRENT_BLOCK
+        self.batch_sizes = []
+        self.log_queries = []
+        self.on_get_logs = lambda: None
+        self.block_receipts_error = None
+        self.logs = [{'transactionHash': tx_hash(i), 'blockNumber': 100 + i % 10} for i in range(1, tx_count + 1)]
+        self.txs = {
+            tx_hash(i): {'hash': tx_hash(i), 'value': 20 * 10 ** 18 if i == 1 else 0}
+            for i in range(1, tx_count + 1)
+        }
+        self.receipts = {
+            tx_hash(i): {'transactionHash': tx_hash(i), 'gasUsed': 21000, 'status': 0 if i == 2 else 1}
+            for i in range(1, tx_count + 1)
+        }
+
+
+class FakeEth:
+    def __init__(self, web3):
+        self.web3 = web3
+        self.chain = web3.chain
+
+    def call(self, method, fn):
+        return FakeCall(self.web3, method, fn)
+
+    @property
+    def block_number(self):
+        return self.call('eth_blockNumber', lambda: self.chain.current_block)
+
+    def get_code(self, address):
+        return self.call('eth_getCode', lambda: b'\x01')
+
+    def get_logs(self, log_filter):
+        def run():
+            self.chain.log_queries.append((log_filter['fromBlock'], log_filter['toBlock']))
+            self.chain.on_get_logs()
+            return [
+                log for log in self.chain.logs
+                if log_filter['fromBlock'] <= log['blockNumber'] <= log_filter['toBlock']
+            ]
+        return self.call('eth_getLogs', run)
+
+    def get_transaction(self, tx):
+        return self.call('eth_getTransactionByHash', lambda: self.chain.txs[tx])
+
+    def get_transaction_receipt(self, tx):
+        return self.call('eth_getTransactionReceipt', lambda: self.chain.receipts[tx])
+
+    def get_block(self, number, full_transactions):
+        return self.call('eth_getBlockByNumber', lambda: {'transactions': [
+            self.chain.txs[log['transactionHash']]
+            for log in self.chain.logs if log['blockNumber'] == number
+        ]})
+
+    def get_block_receipts(self, number):
+        def run():
+            if self.chain.block_receipts_error:
+                raise self.chain.block_receipts_error
+            return [
+                self.chain.receipts[log['transactionHash']]
+                for log in self.chain.logs if log['blockNumber'] == number
+            ]
+        return self.call('eth_getBlockReceipts', run)
+
+
+class FakeWeb3:
+    """One provider on the fake chain, batching state is per provider as in web3"""
+    def __init__(self, chain):
+        self.chain = chain
+        self.is_batching = False
+        self.eth = FakeEth(self)
+
+    def batch_requests(self):
+        return FakeBatch(self)
+
+
+class FakeSocket:
+    def __init__(self, ws_web3):
+        self.ws_web3 = ws_web3
+
+    async def process_subscriptions(self):
+        while True:
+            address = await self.ws_web3.pushes.get()
+            if address is None:
+                raise ConnectionError('socket closed')
+            yield {
+                'subscription': self.ws_web3.subscriptions.get(_checksum(address)),
+                'result': {'address': address}
+            }
+
+
+class FakeWsEth:
+    def __init__(self, ws_web3):
+        self.ws_web3 = ws_web3
+
+    async def subscribe(self, kind, params):
+        subscription_id = f'0x{len(self.ws_web3.subscriptions) + 1}'
+        self.ws_web3.subscriptions[params['address']] = subscription_id
+        return subscription_id
+
+    async def unsubscribe(self, subscription_id):
+        self.ws_web3.unsubscribed.append(subscription_id)
+        return True
+
+
+class FakeWsWeb3:
+    """Websocket connection, every queued address arrives as a pushed log, None drops it"""
+    def __init__(self, ws_url):
+        self.ws_url = ws_url
+        self.subscriptions = {}
+        self.unsubscribed = []
+        self.pushes = asyncio.Queue()
+        self.eth = FakeWsEth(self)
+        self.socket = FakeSocket(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+@pytest.fixture
+def session_factory():
+    engine = create_engine(
+        'sqlite://',
+        connect_args={'check_same_thread': False},
+        poolclass=StaticPool
+    )
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as session:
+        session.add(Contract(
+            address=ADDRESS,
+            network='base',
+            emergency_function='pause()',
+            monitoring_frequency='1min'
+        ))
+        session.commit()
+    return Session
+
+
+@pytest.fixture
+def monitor(session_factory, monkeypatch):
+    monkeypatch.delenv('BASE_WS_URL', raising=False)
+    monkeypatch.delenv('BASESCAN_API_KEY', raising=False)
+    monitor = ContractMonitor(session_factory)
+    monitor.chain = FakeChain()
+
+    async def create_web3(network):
+        return FakeWeb3(monitor.chain)
+
+    monitor._create_web3 = create_web3
+    return monitor
+
+
+@pytest.fixture
+def sockets(monitor, monkeypatch):
+    """Every websocket connection the monitor opens"""
+    sockets = []
+
+    def connect(ws_url):
+        sockets.append(FakeWsWeb3(ws_url))
+        return sockets[-1]
+
+    monkeypatch.setenv('BASE_WS_URL', WS_URL)
+    monkeypatch.setattr(contract_monitor, 'WebSocketProvider', lambda ws_url: ws_url)
+    monkeypatch.setattr(contract_monitor, 'AsyncWeb3', connect)
+    monkeypatch.setattr(contract_monitor, 'SUBSCRIPTION_MIN_BACKOFF', 0)
+    return sockets
+
+
+def add_contract(session_factory, address):
+    with session_factory() as session:
+        session.add(Contract(
+            address=address,
+            network='base',
+            emergency_function='pause()',
+            monitoring_frequency='1min'
+        ))
+        session.commit()
+
+
+async def settle():
+    """Let the subscription tasks run"""
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def start_job(monitor, contract_id=1):
+    """Register a job on the running loop instead of the monitor thread"""
+    monitor._loop = asyncio.get_running_loop()
+    monitor._ensure_loop = lambda: monitor._loop
+    monitor.start_monitoring(contract_id)
+    job = monitor.monitors[contract_id]
+    job['running'] = True
+    return job
+
+
+def test_scan_stores_alerts_and_reschedules(monitor, session_factory):
+    async def run():
+        job = start_job(monitor)
+        await monitor._run_job(1, job)
+        return job, asyncio.get_running_loop().time()
+
+    job, now = asyncio.run(run())
+
+    assert not job['running']
+    assert job['next_run'] == pytest.approx(now + 60, abs=1)
+    with session_factory() as session:
+        assert session.get(MonitorState, 1).last_processed_block == CURRENT_BLOCK
+        assert sorted(alert.type for alert in session.query(Alert)) == [
+            'failed_transaction', 'high_value_transfer'
+        ]
+        assert session.get(Contract, 1).threat_level == 'Medium'
+    assert monitor.last_processed_block[1] == CURRENT_BLOCK
+
+
+def test_scan_resumes_from_watermark(monitor):
+    async def run():
+        job = start_job(monitor)
+        await monitor._run_job(1, job)
+        monitor.chain.current_block = CURRENT_BLOCK + 10
+        job['running'] = True
+        await monitor._run_job(1, job)
+
+    asyncio.run(run())
+
+    assert monitor.chain.log_queries == [
+        (CURRENT_BLOCK - 100, CURRENT_BLOCK),
+        (CURRENT_BLOCK + 1, CURRENT_BLOCK + 10)
+    ]
+
+
+def test_explorer_transactions_are_scanned_behind_head(monitor, session_factory, monkeypatch):
+    monkeypatch.setenv('BASESCAN_API_KEY', 'key')
+    # a reverted call emits no log, only the explorer lists it
+    reverted = tx_hash(3)
+    monitor.chain.txs[reverted] = {'hash': reverted, 'value': 0}
+    monitor.chain.receipts[reverted] = {'transactionHash': reverted, 'gasUsed': 21000, 'status': 0}
+    queries = []
+
+    def get_transaction_hashes(contract_address, network, from_block, to_block):
+        queries.append((from_block, to_block))
+        return [{'hash': reverted.hex(), 'block_number': 105}]
+
+    monkeypatch.setattr(contract_monitor, 'get_transaction_hashes', get_transaction_hashes)
+
+    async def run():
+        job = start_job(monitor)
+        await monitor._run_job(1, job)
+
+    asyncio.run(run())
+
+    head = CURRENT_BLOCK - contract_monitor.EXPLORER_LAG_BLOCKS
+    assert queries == [(head - 100, head)]
+    assert monitor.chain.log_queries == [(head - 100, head)]
+    with session_factory() as session:
+        assert session.get(MonitorState, 1).last_processed_block == head
+        assert [alert.type for alert in session.query(Alert)].count('failed_transaction') == 2
+
+
+def test_explorer_failure_keeps_watermark(monitor, session_factory, monkeypatch):
+    monkeypatch.setenv('BASESCAN_API_KEY', 'key')
+
+    def get_transaction_hashes(*args):
+        raise Exception('API Error: Max rate limit reached')
+
+    monkeypatch.setattr(contract_monitor, 'get_transaction_hashes', get_transaction_hashes)
+
+    async def run():
+        job = start_job(monitor)
+        await monitor._run_job(1, job)
+        return job, asyncio.get_running_loop().time()
+
+    job, now = asyncio.run(run())
+
+    assert job['next_run'] == pytest.approx(now + 60, abs=1)
+    assert 1 not in monitor.last_processed_block
+    with session_factory() as session:
+        assert session.get(MonitorState, 1) is None
+        assert session.query(Alert).count() == 0
+
+
+def test_concurrent_scans_share_a_network(monitor, session_factory):
+    with session_factory() as session:
+        session.add(Contract(
+            address='0x0000000000000000000000000000000000000001',
+            network='base',
+            emergency_function='pause()',
+            monitoring_frequency='1min'
+        ))
+        session.commit()
+
+    async def run():
+        first = start_job(monitor, 1)
+        second = start_job(monitor, 2)
+        # the second scan queries the node while the first awaits its batch
+        await asyncio.gather(monitor._run_job(1, first), monitor._run_job(2, second))
+        return first, second, asyncio.get_running_loop().time()
+
+    first, second, now = asyncio.run(run())
+
+    for job in (first, second):
+        assert job['next_run'] == pytest.approx(now + 60, abs=1)
+    with session_factory() as session:
+        assert [state.last_processed_block for state in session.query(MonitorState)] == [
+            CURRENT_BLOCK, CURRENT_BLOCK
+        ]
+        assert session.query(Alert).count() == 4
+
+
+def test_stop_during_scan_discards_results(monitor, session_factory):
+    monitor.chain.on_get_logs = lambda: monitor.stop_monitoring(1)
+
+    async def run():
+        job = start_job(monitor)
+        monitor.last_processed_block[1] = CURRENT_BLOCK - 50
+        await monitor._run_job(1, job)
+        # let the cleanup scheduled by stop_monitoring run
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+
+    assert 1 not in monitor.monitors
+    assert 1 not in monitor.last_processed_block
+    with session_factory() as session:
+        assert session.get(MonitorState, 1) is None
+        assert session.query(Alert).count() == 0
+
+
+def test_stop_racing_a_commit_leaves_no_state(monitor, session_factory):
+    stopped = []
+
+    def stop_from_other_thread(session):
+        # the delete route stops the contract after the scan checked its job
+        if not stopped:
+            stopped.append(True)
+            thread = threading.Thread(target=monitor.stop_monitoring, args=(1,))
+            thread.start()
+            thread.join()
+
+    event.listen(session_factory, 'before_commit', stop_from_other_thread)
+
+    async def run():
+        job = start_job(monitor)
+        await monitor._run_job(1, job)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+
+    assert stopped
+    assert 1 not in monitor.last_processed_block
+    with session_factory() as session:
+        assert session.get(MonitorState, 1) is None
+
+
+def test_resume_monitoring_continues_from_stored_watermark(monitor, session_factory):
+    with session_factory() as session:
+        session.add(MonitorState(contract_id=1, last_processed_block=110))
+        session.commit()
+
+    async def run():
+        monitor._loop = asyncio.get_running_loop()
+        monitor._ensure_loop = lambda: monitor._loop
+        monitor.resume_monitoring()
+        job = monitor.monitors[1]
+        job['running'] = True
+        await monitor._run_job(1, job)
+
+    asyncio.run(run())
+
+    assert monitor.chain.log_queries == [(111, CURRENT_BLOCK)]
+
+
+def test_missing_contract_stops_monitor(monitor, session_factory):
+    with session_factory() as session:
+        session.delete(session.get(Contract, 1))
+        session.commit()
+
+    async def run():
+        job = start_job(monitor)
+        await monitor._run_job(1, job)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+
+    assert 1 not in monitor.monitors
+
+
+def test_scan_error_backs_off(monitor):
+    async def failing_scan(contract_id, job):
+        # a pushed log must not cut the backoff short
+        job['triggered'] = True
+        raise ConnectionError('rpc down')
+
+    monitor._scan_once = failing_scan
+
+    async def run():
+        job = start_job(monitor)
+        await monitor._run_job(1, job)
+        return job, asyncio.get_running_loop().time()
+
+    job, now = asyncio.run(run())
+
+    assert monitor.monitors[1] is job
+    assert not job['running']
+    assert job['next_run'] == pytest.approx(now + 60, abs=1)
+
+
+def test_transaction_batches_are_bounded(monitor):
+    # two transactions per block at most, so every one is fetched on its own
+    monitor.chain = FakeChain(tx_count=150)
+    for i, log in enumerate(monitor.chain.logs):
+        log['blockNumber'] = CURRENT_BLOCK - 100 + i % 100
+
+    async def run():
+        job = start_job(monitor)
+        await monitor._run_job(1, job)
+
+    asyncio.run(run())
+
+    assert sum(monitor.chain.batch_sizes) == 300
+    assert max(monitor.chain.batch_sizes) <= contract_monitor.MAX_BATCH_CALLS
+
+
+def test_block_batches_are_bounded(monitor, session_factory):
+    # three transactions in each of ten blocks, every block is fetched whole
+    monitor.chain = FakeChain(tx_count=30)
+
+    async def run():
+        job = start_job(monitor)
+        await monitor._run_job(1, job)
+
+    asyncio.run(run())
+
+    assert monitor.chain.batch_sizes == [8, 8, 4]
+    with session_factory() as session:
+        assert session.query(Alert).count() == 2
+
+
+def test_block_fetch_timeout_falls_back_to_transactions(monitor, session_factory):
+    monitor.chain = FakeChain(tx_count=30)
+    monitor.chain.block_receipts_error = asyncio.TimeoutError()
+
+    async def run():
+        job = start_job(monitor)
+        await monitor._run_job(1, job)
+
+    asyncio.run(run())
+
+    # the first block batch times out, then all 30 transactions are fetched one by one
+    assert monitor.chain.batch_sizes == [8, 60]
+    with session_factory() as session:
+        assert session.get(MonitorState, 1).last_processed_block == CURRENT_BLOCK
+        assert session.query(Alert).count() == 2
+
+
+def test_fetch_keeps_cache_hits_evicted_while_fetching(monitor, monkeypatch):
+    monkeypatch.setattr(contract_monitor, 'TX_CACHE_SIZE', 1)
+    chain = monitor.chain
+    cached, missing = chain.logs
+    monitor._tx_cache[('base', cached['transactionHash'])] = (
+        chain.txs[cached['transactionHash']],
+        chain.receipts[cached['transactionHash']]
+    )
+    fetch_missing = monitor._fetch_missing
+
+    async def evicting_fetch(*args):
+        # another scan fills the cache while this one awaits the batch
+        monitor._tx_cache.clear()
+        return await fetch_missing(*args)
+
+    monitor._fetch_missing = evicting_fetch
+
+    transactions = asyncio.run(monitor.fetch_transactions('base', [cached, missing]))
+
+    assert [tx['hash'] for tx, receipt in transactions] == [
+        cached['transactionHash'], missing['transactionHash']
+    ]
+    assert len(monitor._tx_cache) == 1
+
+
+def test_scheduler_restarts_after_crash(session_factory, monkeypatch):
+    monkeypatch.setattr(contract_monitor, 'SCHEDULER_RESTART_DELAY', 0)
+    monitor = ContractMonitor(session_factory)
+    restarted = threading.Event()
+    runs = []
+
+    async def run_scheduler():
+        runs.append(1)
+        if len(runs) == 1:
+            raise RuntimeError('scheduler crashed')
+        restarted.set()
+        await asyncio.Event().wait()
+
+    monitor._run_scheduler = run_scheduler
+    loop = monitor._ensure_loop()
+    try:
+        assert restarted.wait(5)
+        assert not monitor._scheduler.done()
+    finally:
+        monitor._scheduler.cancel()
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0.01), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def test_log_subscriptions_share_one_socket(monitor, session_factory, sockets):
+    add_contract(session_factory, OTHER_ADDRESS)
+
+    async def run():
+        first = start_job(monitor, 1)
+        await monitor._run_job(1, first)
+        await settle()
+        # registered while the socket is already open
+        second = start_job(monitor, 2)
+        await monitor._run_job(2, second)
+        await settle()
+
+        assert len(sockets) == 1
+        assert set(sockets[0].subscriptions) == {_checksum(ADDRESS), _checksum(OTHER_ADDRESS)}
+        assert not monitor._ws_watchers[WS_URL]['pending']
+
+        first['triggered'] = second['triggered'] = False
+        sockets[0].pushes.put_nowait(ADDRESS)
+        await settle()
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert first['triggered']
+    assert not second['triggered']
+    # the polling interval stays scheduled as a fallback
+    assert second['interval'] == 60
+
+
+def test_stop_unsubscribes_and_closes_the_socket(monitor, session_factory, sockets):
+    add_contract(session_factory, OTHER_ADDRESS)
+
+    async def run():
+        first = start_job(monitor, 1)
+        second = start_job(monitor, 2)
+        await monitor._run_job(1, first)
+        await monitor._run_job(2, second)
+        await settle()
+        watcher = monitor._ws_watchers[WS_URL]
+        other_subscription = sockets[0].subscriptions[_checksum(OTHER_ADDRESS)]
+
+        monitor.stop_monitoring(2)
+        await settle()
+        assert sockets[0].unsubscribed == [other_subscription]
+        assert list(watcher['jobs']) == [_checksum(ADDRESS)]
+
+        monitor.stop_monitoring(1)
+        await settle()
+        assert WS_URL not in monitor._ws_watchers
+        assert watcher['task'].cancelled()
+
+    asyncio.run(run())
+
+
+def test_dropped_socket_reconnects_and_triggers_a_scan(monitor, sockets):
+    async def run():
+        job = start_job(monitor)
+        await monitor._run_job(1, job)
+        await settle()
+        job['triggered'] = False
+
+        sockets[0].pushes.put_nowait(None)
+        await settle()
+        return job
+
+    job = asyncio.run(run())
+
+    assert len(sockets) == 2
+    assert list(sockets[1].subscriptions) == [_checksum(ADDRESS)]
+    # blocks missed while disconnected are caught up right away
+    assert job['triggered']